@@ -1,8 +1,12 @@
-import requests
+import asyncio
+import httpx
 import json
+import orjson
 import base64
+import hashlib
 import os
-import time
+import random
+import re
 
 # --------------------------------------------------------
 # CONFIGURATION
@@ -16,8 +20,34 @@ ROOT_FOLDER = "/mnt/c/Users/harshitha.poosar/Downloads/friesland/output"
 OUTPUT_JSON_DIR = "json_results"
 os.makedirs(OUTPUT_JSON_DIR, exist_ok=True)
 
+# Per-image results keyed by sha1 of the image bytes → only new/failed pages are re-sent
+CACHE_DIR = os.path.join(OUTPUT_JSON_DIR, "_cache")
+os.makedirs(CACHE_DIR, exist_ok=True)
+
 MAX_RETRIES = 3
+MAX_BACKOFF = 60              # seconds, cap for exponential backoff and longest Retry-After we wait
+RETRY_STATUSES = (429, 500, 502, 503, 504)
 SLEEP_BETWEEN_REQUESTS = 2    # seconds
+MAX_CONCURRENT_REQUESTS = 5   # in-flight calls; keep under the per-key RPM limit
+PAGES_PER_REQUEST = 4         # images packed into one call (mind the model's image limit)
+IMAGE_MIME_TYPES = {".png": "image/png", ".jpg": "image/jpeg", ".jpeg": "image/jpeg"}
+REQUEST_TIMEOUT = httpx.Timeout(120, connect=10)
+
+# Ask for compressed responses; br only when brotli is there for httpx to decode it
+try:
+    import brotli  # noqa: F401
+    ACCEPT_ENCODING = "br, gzip"
+except ImportError:
+    ACCEPT_ENCODING = "gzip"
+
+HEADERS = {
+    "Authorization": f"Bearer {API_KEY}",
+    "Content-Type": "application/json",
+    "Accept-Encoding": ACCEPT_ENCODING
+}
+
+# HTTP/2 multiplexes the concurrent calls over a few warm connections
+HTTP_LIMITS = httpx.Limits(max_keepalive_connections=20, max_connections=50)
 
 
 # --------------------------------------------------------
@@ -25,7 +55,13 @@ SLEEP_BETWEEN_REQUESTS = 2    # seconds
 # --------------------------------------------------------
 def encode_image(path):
     with open(path, "rb") as f:
-        return base64.b64encode(f.read()).decode("utf-8")
+        # base64 output is pure ASCII → cheaper decode than utf-8
+        return base64.b64encode(f.read()).decode("ascii")
+
+
+def image_data_url(path):
+    mime = IMAGE_MIME_TYPES[os.path.splitext(path)[1].lower()]
+    return f"data:{mime};base64,{encode_image(path)}"
 
 
 # --------------------------------------------------------
@@ -101,7 +137,7 @@ Expected JSON:
 # 3. MAIN PROMPT (YOUR EXACT CONTENT)
 # --------------------------------------------------------
 main_prompt = """
-Extract promo flyer details from the attached image.
+Extract promo flyer details from each attached image.
 
 Return JSON with:
 - brand
@@ -117,8 +153,9 @@ Rules:
 - Return all prices EXACTLY as printed (including "Rp" and dots)
 - If something is missing, return ""
 - Output JSON only
+- Return a JSON array with exactly one object per image, in the same order as the images
 
-JSON structure:
+JSON structure (one per image):
 
 {
   "image_id": "",
@@ -138,45 +175,82 @@ JSON structure:
 """
 
 
+# Fixed part of every request, built once instead of per image
+CHAT_URL = f"{BASE_URL}/v1/chat/completions"
+_STATIC_SYSTEM_MSG = {"role": "system", "content": few_shot_examples}
+_STATIC_USER_TEXT = {"type": "text", "text": main_prompt}
+
+
+def retry_delay(attempt, response=None):
+    """Seconds to wait before retrying: the server's Retry-After (as given), else 2^n + jitter."""
+    if response is not None:
+        retry_after = response.headers.get("Retry-After", "")
+        if retry_after.isdigit():
+            return int(retry_after)
+    return min(MAX_BACKOFF, 2 ** attempt + random.uniform(0, 1))
+
+
 # --------------------------------------------------------
 # 4. CALL GEMINI WITH RETRY + RATE LIMIT HANDLING
 # --------------------------------------------------------
-def call_gemini(image_b64):
-    url = f"{BASE_URL}/v1/chat/completions"
-
-    payload = {
+async def call_gemini(client, image_urls):
+    payload = orjson.dumps({
         "model": MODEL_NAME,
         "messages": [
-            {"role": "system", "content": few_shot_examples},
+            _STATIC_SYSTEM_MSG,
             {
                 "role": "user",
-                "content": [
-                    {"type": "text", "text": main_prompt},
-                    {"type": "image_url", "image_url": {"url": f"data:image/png;base64,{image_b64}"}}
+                "content": [_STATIC_USER_TEXT] + [
+                    {"type": "image_url", "image_url": {"url": url}}
+                    for url in image_urls
                 ]
             }
         ]
-    }
-
-    headers = {
-        "Authorization": f"Bearer {API_KEY}",
-        "Content-Type": "application/json"
-    }
+    })
 
     # Retry logic
+    data = {"error": {"code": "", "message": "No attempt made"}}
     for attempt in range(MAX_RETRIES):
-        response = requests.post(url, headers=headers, json=payload)
-        data = response.json()
+        last_attempt = attempt == MAX_RETRIES - 1
+
+        # TRANSPORT ERROR (timeout, reset, DNS) → RETRY
+        try:
+            response = await client.post(CHAT_URL, content=payload)
+        except httpx.TransportError as e:
+            data = {"error": {"code": "transport", "message": str(e)}}
+            if last_attempt:
+                break
+            wait = retry_delay(attempt)
+            print(f"   🔁 {type(e).__name__}. Retrying in {wait:.1f} sec...")
+            await asyncio.sleep(wait)
+            continue
+
+        try:
+            data = response.json()
+        except ValueError:  # JSONDecodeError, or UnicodeDecodeError on a non-UTF-8 body
+            data = None
 
         # SUCCESS
-        if "error" not in data:
+        if response.is_success and isinstance(data, dict) and "error" not in data:
             return data
 
-        # RATE LIMIT → WAIT & RETRY
-        if data["error"].get("code") == "429":
-            wait = (attempt + 1) * 5
-            print(f"   🔁 Rate limit hit. Retrying in {wait} sec...")
-            time.sleep(wait)
+        if not isinstance(data, dict) or "error" not in data:
+            data = {"error": {"code": str(response.status_code), "message": response.text[:500]}}
+
+        error = data["error"]
+        code = str(error.get("code", "")) if isinstance(error, dict) else ""
+
+        # RATE LIMIT / SERVER ERROR → BACK OFF & RETRY
+        if response.status_code in RETRY_STATUSES or code == "429":
+            if last_attempt:
+                break
+            wait = retry_delay(attempt, response)
+            # Retrying before the server allows only burns attempts
+            if wait > MAX_BACKOFF:
+                print(f"   ⛔ HTTP {response.status_code}. Retry-After {wait} sec is too long, giving up")
+                break
+            print(f"   🔁 HTTP {response.status_code}. Retrying in {wait:.1f} sec...")
+            await asyncio.sleep(wait)
             continue
 
         # OTHER ERROR → RETURN
@@ -188,96 +262,278 @@ def call_gemini(image_b64):
 # --------------------------------------------------------
 # 5. CLEAN JSON
 # --------------------------------------------------------
+# ```json ... ``` fence (anything after the closing fence dropped), or a bare "json" label
+_FENCE_RE = re.compile(r'(?:```\s*(?:json)?(.*?)(?:```.*)?|(?:json)?(.*))', re.S)
+
+
 def clean_json(text):
-    if not text or text.strip() == "":
+    if not text:
         return None
 
-    text = text.strip()
+    m = _FENCE_RE.fullmatch(text.strip())
+    cleaned = m.group(1) if m.group(1) is not None else m.group(2)
+    return cleaned.strip() or None
 
-    # Remove ``` code fences
-    if text.startswith("```"):
-        parts = text.split("```")
-        if len(parts) > 1:
-            text = parts[1]
 
-    # Remove "json" label
-    if text.strip().startswith("json"):
-        text = text.strip()[4:]
+# Top-level keys of a whole-page result (see excel_gen's extractors)
+PAGE_RESULT_KEYS = ("items", "promo_items", "offers")
 
-    return text.strip()
+
+def is_page_result(value):
+    """A page's output is a list of items or a dict holding one of the known item lists."""
+    if isinstance(value, list):
+        return True
+    return isinstance(value, dict) and any(key in value for key in PAGE_RESULT_KEYS)
+
+
+def split_batch_output(parsed, count):
+    """Map the model's JSON array back to one result per image of the batch."""
+    if count == 1:
+        # Single image: unwrap the prompt's one-element array of page objects;
+        # any other shape (e.g. a flat item list) is stored unchanged
+        if (isinstance(parsed, list) and len(parsed) == 1
+                and isinstance(parsed[0], dict) and is_page_result(parsed[0])):
+            return parsed
+        return [parsed]
+
+    if not isinstance(parsed, list) or len(parsed) != count:
+        got = len(parsed) if isinstance(parsed, list) else type(parsed).__name__
+        raise ValueError(f"Expected a JSON array of {count} results, got {got}")
+
+    # A flat item list that happens to have `count` entries is not per-image output
+    if not all(is_page_result(result) for result in parsed):
+        raise ValueError(f"Expected {count} page results, got a flat list of items")
+
+    return parsed
 
 
 # --------------------------------------------------------
-# 6. PROCESS ALL FOLDERS → ONE JSON PER FOLDER
+# 6. PROCESS ONE BATCH OF PAGES (BOUNDED BY THE SEMAPHORE)
 # --------------------------------------------------------
-for folder in os.listdir(ROOT_FOLDER):
+async def process_batch(sem, client, folder, batch):
+    names = [img_file for img_file, _, _ in batch]
+
+    async with sem:
+        print(f" Processing {folder}/{', '.join(names)}")
+
+        # File read + base64 off the event loop → other batches keep their requests moving
+        image_urls = await asyncio.gather(
+            *(asyncio.to_thread(image_data_url, img_path) for _, img_path, _ in batch)
+        )
+
+        result = await call_gemini(client, image_urls)
+        # Sleep while still holding the slot → rate limit is kept per worker
+        await asyncio.sleep(SLEEP_BETWEEN_REQUESTS)
+
+    # API ERROR
+    if "error" in result:
+        print(f" Error for {', '.join(names)}: {result['error']}")
+        return [
+            {"page_name": img_file, "error": result["error"]}
+            for img_file in names
+        ]
 
-    folder_path = os.path.join(ROOT_FOLDER, folder)
-    if not os.path.isdir(folder_path):
-        continue
+    content = None
+    try:
+        content = result["choices"][0]["message"]["content"]
+        cleaned = clean_json(content)
 
-    pages_dir = os.path.join(folder_path, "pages")
-    if not os.path.exists(pages_dir):
-        continue
+        if cleaned is None:
+            raise ValueError("Empty model output")
 
-    print(f"\n Processing folder: {folder}")
+        parsed = split_batch_output(json.loads(cleaned), len(batch))
 
-    folder_result = {
-        "folder": folder,
-        "pages": []
-    }
+        for (_, _, digest), parsed_json in zip(batch, parsed):
+            save_cached(digest, parsed_json)
 
-    for img_file in sorted(os.listdir(pages_dir)):
+        print(f" Extracted from {folder}/{', '.join(names)}")
+        return [
+            {"page_name": img_file, "extracted_data": parsed_json}
+            for img_file, parsed_json in zip(names, parsed)
+        ]
 
-        if not img_file.lower().endswith((".png", ".jpg", ".jpeg")):
-            continue
+    except Exception as e:
+        print(f" JSON error on {', '.join(names)}: {e}")
+        return [
+            {
+                "page_name": img_file,
+                "error": f"JSON parse error: {str(e)}",
+                "raw_output": content
+            }
+            for img_file in names
+        ]
 
-        img_path = os.path.join(pages_dir, img_file)
-        print(f" Processing {img_file}")
 
-        image_b64 = encode_image(img_path)
+# --------------------------------------------------------
+# 7. INCREMENTAL RUNS: SKIP UNCHANGED FOLDERS + PAGE CACHE
+# --------------------------------------------------------
+def file_sha1(path):
+    with open(path, "rb") as f:
+        return hashlib.sha1(f.read()).hexdigest()
 
-        result = call_gemini(image_b64)
-        time.sleep(SLEEP_BETWEEN_REQUESTS)
 
-        # API ERROR
-        if "error" in result:
-            print(f" Error for {img_file}: {result['error']}")
-            folder_result["pages"].append({
-                "page_name": img_file,
-                "error": result["error"]
-            })
-            continue
+def write_atomic(path, data):
+    """Write bytes via a temp file + os.replace → a killed run never leaves a truncated file."""
+    tmp = f"{path}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(data)
+    os.replace(tmp, path)
 
-        try:
-            content = result["choices"][0]["message"]["content"]
-            cleaned = clean_json(content)
 
-            if cleaned is None:
-                raise ValueError("Empty model output")
+def load_cached(digest):
+    path = os.path.join(CACHE_DIR, f"{digest}.json")
+    if not os.path.exists(path):
+        return None
+    # Unreadable entry → cache miss, the page is simply re-sent
+    try:
+        with open(path, "rb") as f:
+            return orjson.loads(f.read())
+    except (orjson.JSONDecodeError, OSError):
+        return None
 
-            parsed_json = json.loads(cleaned)
 
-            folder_result["pages"].append({
-                "page_name": img_file,
-                "extracted_data": parsed_json
-            })
+def save_cached(digest, extracted):
+    path = os.path.join(CACHE_DIR, f"{digest}.json")
+    write_atomic(path, orjson.dumps(extracted))
 
-            print(f" Extracted from {img_file}")
 
-        except Exception as e:
-            print(f" JSON error on {img_file}: {e}")
-            folder_result["pages"].append({
-                "page_name": img_file,
-                "error": f"JSON parse error: {str(e)}",
-                "raw_output": content
-            })
+def folder_is_current(out_path, images):
+    """True if the folder JSON is newer than every page and holds no failed pages."""
+    if not images or not os.path.exists(out_path):
+        return False
+
+    newest_page = max(os.path.getmtime(img_path) for _, img_path in images)
+    if os.path.getmtime(out_path) <= newest_page:
+        return False
+
+    # Truncated/unparsable JSON (e.g. NaN from an older run) → just redo the folder
+    try:
+        with open(out_path, "rb") as f:
+            previous = orjson.loads(f.read())
+    except (orjson.JSONDecodeError, OSError):
+        return False
+    if not isinstance(previous, dict):
+        return False
+    return all("error" not in page for page in previous.get("pages", []))
+
+
+# --------------------------------------------------------
+# 8. PROCESS ALL FOLDERS → ONE JSON PER FOLDER
+# --------------------------------------------------------
+def collect_pages():
+    """Return {folder: [(img_file, img_path), ...]} for every folder with pages."""
+    folders = {}
+
+    for folder in os.listdir(ROOT_FOLDER):
+
+        folder_path = os.path.join(ROOT_FOLDER, folder)
+        if not os.path.isdir(folder_path):
+            continue
+
+        pages_dir = os.path.join(folder_path, "pages")
+        if not os.path.exists(pages_dir):
+            continue
+
+        # scandir's DirEntry caches name/type → one directory pass, no extra joins or stats
+        with os.scandir(pages_dir) as it:
+            entries = sorted(
+                (e for e in it
+                 if e.is_file() and os.path.splitext(e.name)[1].lower() in IMAGE_MIME_TYPES),
+                key=lambda e: e.name
+            )
+        folders[folder] = [(entry.name, entry.path) for entry in entries]
+
+    return folders
+
+
+def save_folder(folder, folder_pages, images):
+    """Write one folder's JSON with its pages in sorted file order."""
+    folder_result = {
+        "folder": folder,
+        "pages": [folder_pages[img_file] for img_file, _ in images]
+    }
 
-    # SAVE RESULT FOR THIS FOLDER
     out_path = os.path.join(OUTPUT_JSON_DIR, f"{folder}.json")
-    with open(out_path, "w", encoding="utf-8") as f:
-        json.dump(folder_result, f, indent=2, ensure_ascii=False)
+    write_atomic(out_path, json.dumps(folder_result, indent=2, ensure_ascii=False).encode("utf-8"))
 
     print(f" Saved → {out_path}")
 
 
+async def process_folder(sem, client, folder, images, folder_pages, pending):
+    """Run one folder's batches, then save it as soon as its own pages are done."""
+    # Consecutive pages of one folder share a request → prompt tokens paid once per batch
+    batches = [pending[i:i + PAGES_PER_REQUEST] for i in range(0, len(pending), PAGES_PER_REQUEST)]
+
+    # A failing batch becomes page errors instead of aborting the other batches
+    outcomes = await asyncio.gather(
+        *(process_batch(sem, client, folder, batch) for batch in batches),
+        return_exceptions=True
+    )
+
+    for batch, outcome in zip(batches, outcomes):
+        if isinstance(outcome, BaseException):
+            if not isinstance(outcome, Exception):
+                raise outcome
+            names = [img_file for img_file, _, _ in batch]
+            print(f" Error for {folder}/{', '.join(names)}: {outcome}")
+            outcome = [
+                {"page_name": img_file, "error": f"{type(outcome).__name__}: {outcome}"}
+                for img_file in names
+            ]
+
+        for page in outcome:
+            folder_pages[page["page_name"]] = page
+
+    save_folder(folder, folder_pages, images)
+
+
+async def main():
+    folders = collect_pages()
+
+    results = {}
+    pending = {}
+    for folder, images in folders.items():
+        out_path = os.path.join(OUTPUT_JSON_DIR, f"{folder}.json")
+        if folder_is_current(out_path, images):
+            print(f" Up to date, skipping: {folder}")
+            continue
+
+        results[folder] = {}
+        pending[folder] = []
+        for img_file, img_path in images:
+            digest = file_sha1(img_path)
+            cached = load_cached(digest)
+            if cached is not None:
+                # Entries saved while one-image replies were kept wrapped → unwrap them too
+                (cached,) = split_batch_output(cached, 1)
+                results[folder][img_file] = {"page_name": img_file, "extracted_data": cached}
+            else:
+                pending[folder].append((img_file, img_path, digest))
+
+    page_count = sum(len(items) for items in pending.values())
+    request_count = sum(-(-len(items) // PAGES_PER_REQUEST) for items in pending.values())
+    print(f"\n Processing {page_count} pages from {len(pending)} folders in {request_count} requests")
+
+    sem = asyncio.Semaphore(MAX_CONCURRENT_REQUESTS)
+    async with httpx.AsyncClient(
+        http2=True,
+        headers=HEADERS,
+        limits=HTTP_LIMITS,
+        timeout=REQUEST_TIMEOUT
+    ) as client:
+        # Each folder is written when its own batches finish → one failure can't lose the rest
+        outcomes = await asyncio.gather(
+            *(
+                process_folder(sem, client, folder, folders[folder], results[folder], items)
+                for folder, items in pending.items()
+            ),
+            return_exceptions=True
+        )
+
+    for folder, outcome in zip(pending, outcomes):
+        if isinstance(outcome, BaseException):
+            print(f" Failed to save {folder}: {outcome}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -1,6 +1,7 @@
 import os
-import json
-import pandas as pd
+import re
+import orjson
+from openpyxl import Workbook
 
 
 # ============================================================
@@ -9,41 +10,57 @@ import pandas as pd
 JSON_FOLDER = "json_results"
 OUTPUT_EXCEL = "final_output.xlsx"
 
+# Final Excel columns, in sheet order
+COLUMNS = (
+    "folder", "page_name", "image_id", "period", "brand", "sku_name",
+    "promo_type", "mechanic", "regular_price", "promo_price", "confidence", "unit"
+)
+
+# Label split: brand = words before the first digit-bearing token, SKU = the rest
+# Tokens are separated by plain spaces only; tabs/newlines/NBSP stay inside a token
+_LABEL_SPLIT = re.compile(r'^(?P<brand>\D+?) +(?P<sku>[^ ]*\d.*)$', re.S)
+_LEADING_DIGIT_TOKEN = re.compile(r'[^ ]*\d')
+
 
 # ============================================================
 # 2. ROW NORMALIZATION HELPERS
 # ============================================================
 
+_MISSING = (None, "")
+
+# Cell types write-only openpyxl accepts as-is; anything else (lists/dicts from
+# the model) is written as str(), as pandas' to_excel did
+_CELL_TYPES = (str, int, float, bool, type(None))
+
+
 def safe_get(obj, *keys):
     """
     Utility: return the first non-empty key found in a dict.
     """
-    for key in keys:
-        if isinstance(obj, dict) and key in obj and obj[key] not in [None, ""]:
-            return obj[key]
-    return ""
+    if not isinstance(obj, dict):
+        return ""
+    return next((obj[k] for k in keys if obj.get(k) not in _MISSING), "")
 
 
 def build_row(folder, page, **kwargs):
     """
-    Create a consistent row with all final Excel columns.
+    Create a consistent row tuple with all final Excel columns (COLUMNS order).
     """
-    base = {
-        "folder": folder,
-        "page_name": page,
-        "image_id": "",
-        "period": "",
-        "brand": "",
-        "sku_name": "",
-        "promo_type": "",
-        "mechanic": "",
-        "regular_price": "",
-        "promo_price": "",
-        "confidence": "",
-        "unit": ""
-    }
-    base.update(kwargs)
-    return base
+    row = (
+        folder,
+        page,
+        kwargs.get("image_id", ""),
+        kwargs.get("period", ""),
+        kwargs.get("brand", ""),
+        kwargs.get("sku_name", ""),
+        kwargs.get("promo_type", ""),
+        kwargs.get("mechanic", ""),
+        kwargs.get("regular_price", ""),
+        kwargs.get("promo_price", ""),
+        kwargs.get("confidence", ""),
+        kwargs.get("unit", "")
+    )
+    return tuple(v if isinstance(v, _CELL_TYPES) else str(v) for v in row)
 
 
 # ============================================================
@@ -96,15 +113,16 @@ def extract_label_items(folder, page, items):
         clean = label.strip()
 
         # Try split into brand + rest
-        parts = clean.split(" ")
-        split_index = 1
-        for idx, token in enumerate(parts):
-            if any(ch.isdigit() for ch in token):  # first digit-containing token = SKU starts
-                split_index = idx
-                break
+        m = _LABEL_SPLIT.match(clean)
+        if m:
+            brand, sku = m.group("brand"), m.group("sku")
+        elif _LEADING_DIGIT_TOKEN.match(clean):  # first token already has digits → all SKU
+            brand, sku = "", clean
+        else:  # no digits at all → first word is the brand
+            brand, _, sku = clean.partition(" ")
 
-        brand = " ".join(parts[:split_index]).strip()
-        sku = " ".join(parts[split_index:]).strip()
+        brand = brand.strip()
+        sku = sku.strip()
 
         rows.append(
             build_row(
@@ -195,19 +213,23 @@ def extract_offers(folder, page, extracted):
 # 4. MASTER EXTRACTOR — AUTO-DETECT JSON TYPE
 # ============================================================
 
+# Marker key → parser for dict-shaped pages, checked in this order
+_DICT_EXTRACTORS = {
+    "items": extract_standard_flyer,
+    "promo_items": extract_promo_items,
+    "offers": extract_offers,
+}
+
+
 def extract_rows(folder, page_name, extracted):
     """Detects JSON format and calls correct parser."""
-    if isinstance(extracted, dict) and "items" in extracted:
-        return extract_standard_flyer(folder, page_name, extracted)
-
     if isinstance(extracted, list):
         return extract_list_items(folder, page_name, extracted)
 
-    if isinstance(extracted, dict) and "promo_items" in extracted:
-        return extract_promo_items(folder, page_name, extracted)
-
-    if isinstance(extracted, dict) and "offers" in extracted:
-        return extract_offers(folder, page_name, extracted)
+    if isinstance(extracted, dict):
+        for key, extractor in _DICT_EXTRACTORS.items():
+            if key in extracted:
+                return extractor(folder, page_name, extracted)
 
     return []
 
@@ -217,14 +239,18 @@ def extract_rows(folder, page_name, extracted):
 # ============================================================
 
 def process_json_folder():
-    all_rows = []
+    # write_only streams rows to disk → memory stays flat regardless of row count
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet("Sheet1")
+    ws.append(COLUMNS)
+    row_count = 0
 
     for file in os.listdir(JSON_FOLDER):
         if not file.endswith(".json"):
             continue
 
-        with open(os.path.join(JSON_FOLDER, file), "r", encoding="utf-8") as f:
-            data = json.load(f)
+        with open(os.path.join(JSON_FOLDER, file), "rb") as f:
+            data = orjson.loads(f.read())
 
         folder = data.get("folder", "")
         pages = data.get("pages", [])
@@ -235,12 +261,12 @@ def process_json_folder():
             page_name = page.get("page_name", "")
             extracted = page.get("extracted_data", {})
 
-            rows = extract_rows(folder, page_name, extracted)
-            all_rows.extend(rows)
+            for row in extract_rows(folder, page_name, extracted):
+                ws.append(row)
+                row_count += 1
 
-    df = pd.DataFrame(all_rows)
-    df.to_excel(OUTPUT_EXCEL, index=False, engine="openpyxl")
-    print("\n FINAL EXCEL CREATED →", OUTPUT_EXCEL)
+    wb.save(OUTPUT_EXCEL)
+    print(f"\n FINAL EXCEL CREATED → {OUTPUT_EXCEL} ({row_count} rows)")
 
 
 # ============================================================
@@ -1,50 +1,160 @@
 import asyncio
+import httpx
+import logging
+import multiprocessing
+import queue
 import re
 import os
+import shutil
+from concurrent.futures import ProcessPoolExecutor
+from hashlib import blake2b
+from logging.handlers import QueueHandler, QueueListener
 from pathlib import Path
 from typing import Optional
-from playwright.async_api import async_playwright, Page, Frame
+from urllib.parse import urlsplit
+from playwright.async_api import async_playwright, BrowserContext, Page
 
 # ================== CONFIG ==================
 PROMO_LIST_URL = "https://www.indomaret.co.id/promosi"
 NAV_TIMEOUT = 180_000
 DOWNLOAD_TIMEOUT = 120_000
+DOWNLOAD_CHUNK_SIZE = 1 << 16  # PDFs are streamed to disk in 64 KB chunks
 CONVERT_PDF_TO_PNG = True
+CAPTURE_CONCURRENCY = 4      # promos captured at once; keep polite to the site
+JPEG_QUALITY = 85            # rendered pages are JPEG → far smaller uploads than PNG
+PDF_ZOOM = 2                 # render scale for PDF pages
+NETWORK_QUIET_MS = 1_500     # page counts as settled after this long with no requests
+NETWORK_QUIET_CAP_MS = 10_000  # ...but never wait longer than this (beacons/long-polls)
+PAGE_TURN_TIMEOUT_MS = 3_000   # max wait for a flipbook page to re-render after "next"
+PDF_CACHE_DIR = Path("output") / "_pdf_cache"  # flyers shared across promos/runs
 # ============================================
 
+log = logging.getLogger("indomaret")
+
+# PyMuPDF is optional: without it PDFs are downloaded but not rasterized
+try:
+    import fitz
+    _ZOOM_MAT = fitz.Matrix(PDF_ZOOM, PDF_ZOOM)
+except ImportError:
+    fitz = None
+    _ZOOM_MAT = None
+
+# Compiled once → no per-frame / per-card pattern cache lookups
+_PDF_URL_RE = re.compile(r'"pdfUrl"\s*:\s*"([^"]+)"')
+_PDF_HTTPS_RE = re.compile(r'https://[^"\']+\.pdf')
+_FLIP_IDX_RE = re.compile(r'(https://img\.indomaret\.co\.id[^"\']+index\.html)')
+_ONCLICK_RE = re.compile(r"['\"](/[^'\"]+)['\"]")
+# Flipbook/real3d image URLs allowed through the route handler (one pass per request)
+_FLIP_IMAGE_RE = re.compile(r'flip|page|/uploads/|\.(?:png|jpe?g)$')
+# Analytics/ads hosts: never needed for the flyer, only keep the network busy
+_TRACKER_RE = re.compile(
+    r'google-analytics\.com|googletagmanager\.com|doubleclick\.net|googlesyndication\.com'
+    r'|facebook\.net|connect\.facebook|hotjar\.com|tiktok\.com/i18n/pixel'
+)
+
+def setup_logging() -> QueueListener:
+    # Callers only enqueue records; one background thread does the stdout writes
+    records = queue.SimpleQueue()
+    console = logging.StreamHandler()
+    console.setFormatter(logging.Formatter("%(message)s"))
+    logging.basicConfig(level=logging.INFO, handlers=[QueueHandler(records)])
+    logging.getLogger("httpx").setLevel(logging.WARNING)  # no per-request INFO lines
+
+    listener = QueueListener(records, console)
+    listener.start()
+    return listener
+
+# Characters Windows rejects in folder names → deleted in one C-level pass
+_SAFE_TABLE = str.maketrans("", "", '\\/*?:"<>|\0')
+
+
 def safe(name: str):
     name = (name or "").strip()
-    name = re.sub(r'[\\/*?:"<>|]', "", name)
+    name = name.translate(_SAFE_TABLE)
     return name or "untitled"
 
 # ============================================================
 # BLOCK NON-FLIP IMAGES
 # ============================================================
-async def block_nonflip_images(page: Page):
+async def block_nonflip_images(target: BrowserContext):
     async def handler(route):
-        url = (route.request.url or "").lower()
-        if route.request.resource_type == "image":
+        if _TRACKER_RE.search(route.request.url or ""):
+            await route.abort()
+        elif route.request.resource_type == "image":
+            url = (route.request.url or "").lower()
             # Allow only flipbook/real3d images
-            if ("flip" in url or "page" in url or "/uploads/" in url
-                or url.endswith((".png", ".jpg", ".jpeg"))):
+            if _FLIP_IMAGE_RE.search(url):
                 await route.continue_()
             else:
                 await route.abort()
         else:
             await route.continue_()
-    await page.route("**/*", handler)
+    # Installed once per context → every page opened in it is covered
+    await target.route("**/*", handler)
+
+# ============================================================
+# BOUNDED NETWORK-QUIET WAIT (instead of networkidle / fixed sleeps)
+# ============================================================
+def track_inflight_requests(page: Page) -> set:
+    # Attach before goto so requests started during navigation are counted
+    pending = set()
+    page.on("request", pending.add)
+    page.on("requestfinished", pending.discard)
+    page.on("requestfailed", pending.discard)
+    return pending
+
+
+async def wait_for_network_quiet(pending: set,
+                                 quiet_ms: int = NETWORK_QUIET_MS,
+                                 cap_ms: int = NETWORK_QUIET_CAP_MS):
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + cap_ms / 1000
+    quiet_since = loop.time()
+
+    while loop.time() < deadline:
+        await asyncio.sleep(0.1)
+        if pending:
+            quiet_since = loop.time()
+        elif loop.time() - quiet_since >= quiet_ms / 1000:
+            return
+
+# ============================================================
+# EARLY PDF DETECTION (first .pdf request wins the race)
+# ============================================================
+def watch_pdf_requests(page: Page) -> asyncio.Future:
+    pdf_seen = asyncio.get_running_loop().create_future()
+
+    def on_request(request):
+        if not pdf_seen.done() and urlsplit(request.url).path.lower().endswith(".pdf"):
+            pdf_seen.set_result(request.url)
+
+    page.on("request", on_request)
+    return pdf_seen
+
+
+async def load_promo_page(page: Page, url: str, inflight: set):
+    await page.goto(url, wait_until="load", timeout=NAV_TIMEOUT)
+
+    # CRITICAL: wait for dynamic JS/Real3D scripts (until the network goes quiet)
+    await wait_for_network_quiet(inflight)
+
+    # Try to wait for Real3D <script> tag
+    try:
+        await page.wait_for_selector('script[id^="real3d-flipbook-options"]', timeout=5000)
+    except:
+        pass
 
 # ============================================================
 # HTML EXTRACTORS
 # ============================================================
 async def extract_pdf_url_from_html(html: str) -> Optional[str]:
     # Real3D flipbookOptions JSON
-    m = re.search(r'"pdfUrl"\s*:\s*"([^"]+)"', html)
+    m = _PDF_URL_RE.search(html)
     if m:
         return m.group(1).replace("\\/", "/")
 
     # Generic .pdf
-    m = re.search(r'https://[^"\']+\.pdf', html)
+    m = _PDF_HTTPS_RE.search(html)
     if m:
         return m.group(0)
 
@@ -52,88 +162,227 @@ async def extract_pdf_url_from_html(html: str) -> Optional[str]:
 
 
 async def extract_flipbook_index_html(html: str) -> Optional[str]:
-    m = re.search(r'(https://img\.indomaret\.co\.id[^"\']+index\.html)', html)
+    m = _FLIP_IDX_RE.search(html)
     if m:
         return m.group(1).replace("\\/", "/")
     return None
 
 
+# Inline <script> text + iframe/embed/object sources: where pdfUrl and the
+# flipbook index.html live, a fraction of the bytes of page.content().
+# Parts are joined with a quote so the [^"']+ URL patterns stop at each
+# part's end, as they do at attribute quotes in the full HTML.
+_SCRIPTS_AND_EMBEDS_JS = """() => [
+    ...Array.from(document.scripts, s => s.textContent),
+    ...Array.from(document.querySelectorAll('iframe, embed, object'), e => e.src || e.data || '')
+].join('"\\n"')"""
+
+
 # ============================================================
-# RECURSIVE FRAME PDF DETECTION (Critical Fix)
+# IFRAME PDF DETECTION
 # ============================================================
-async def find_pdf_in_frames_recursively(frame: Frame) -> Optional[str]:
+# One evaluate returns the HTML of the page and every same-origin iframe;
+# cross-origin iframes (contentDocument is null) are only counted.
+_FRAMES_HTML_JS = """() => {
+    const html = [];
+    let blocked = 0;
+    const walk = (doc) => {
+        html.push(doc.documentElement.outerHTML);
+        for (const f of doc.querySelectorAll('iframe')) {
+            let child = null;
+            try { child = f.contentDocument; } catch (e) {}
+            if (child && child.documentElement) walk(child); else blocked++;
+        }
+    };
+    walk(document);
+    return {html, blocked};
+}"""
+
+
+async def extract_pdf_from_iframes(page: Page) -> Optional[str]:
+    # ---- free check: a viewer frame pointing straight at the PDF needs no DOM ----
+    for frame in page.frames:
+        if urlsplit(frame.url or "").path.lower().endswith(".pdf"):
+            return frame.url
+
+    # ---- fast path: one DevTools round-trip for all same-origin frames ----
     try:
-        html = await frame.content()
-        m = re.search(r'https://[^"\']+\.pdf', html)
+        found = await page.evaluate(_FRAMES_HTML_JS)
+        m = _PDF_HTTPS_RE.search("\n".join(found["html"]))
         if m:
             return m.group(0)
+        if not found["blocked"]:
+            return None
     except:
         pass
 
-    for child in frame.child_frames:
-        pdf = await find_pdf_in_frames_recursively(child)
-        if pdf:
-            return pdf
-
-    return None
+    # ---- fallback: cross-origin frames need Playwright's per-frame content() ----
+    # page.frames is already the flattened frame tree; fetch all at once, first match wins
+    tasks = [asyncio.create_task(frame.content()) for frame in page.frames]
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            try:
+                html = await next_done
+            except:
+                continue
 
+            m = _PDF_HTTPS_RE.search(html)
+            if m:
+                return m.group(0)
+    finally:
+        for t in tasks:
+            t.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
 
-async def extract_pdf_from_iframes(page: Page) -> Optional[str]:
-    for frame in page.frames:
-        pdf = await find_pdf_in_frames_recursively(frame)
-        if pdf:
-            return pdf
     return None
 
 
 # ============================================================
 # PDF DOWNLOAD & PDF → PNG CONVERSION
 # ============================================================
-async def download_pdf(page: Page, url: str, dest: Path) -> bool:
+async def _stream_pdf(http: httpx.AsyncClient, url: str, dest: Path) -> bool:
+    # Write to a .part sibling and rename → an interrupted download never
+    # leaves a truncated PDF where the cache check would trust it
+    tmp = dest.with_suffix(dest.suffix + ".part")
     try:
-        print(f"  → Downloading PDF: {url}")
-        resp = await page.request.get(url, timeout=DOWNLOAD_TIMEOUT)
-        if resp.status != 200:
-            print("   PDF download failed")
-            return False
-
-        dest.write_bytes(await resp.body())
-        print(f"   Saved PDF: {dest}")
+        log.info(f"  → Downloading PDF: {url}")
+        async with http.stream("GET", url) as resp:
+            if resp.status_code != 200:
+                log.warning("   PDF download failed")
+                return False
+
+            # Stream to disk → peak memory is one chunk, not the whole PDF
+            with open(tmp, "wb") as f:
+                async for chunk in resp.aiter_bytes(DOWNLOAD_CHUNK_SIZE):
+                    f.write(chunk)
+
+        os.replace(tmp, dest)
         return True
 
     except Exception as e:
-        print(f"  PDF error: {e}")
+        log.warning(f"  PDF error: {e}")
         return False
 
+    finally:
+        tmp.unlink(missing_ok=True)
+
+
+async def _cached_pdf(http: httpx.AsyncClient, url: str) -> Optional[Path]:
+    cached = PDF_CACHE_DIR / f"{blake2b(url.encode(), digest_size=16).hexdigest()}.pdf"
+
+    # Reuse an earlier run's copy if the server still reports the same size
+    if cached.exists():
+        try:
+            head = await http.head(url)
+            # An error page's Content-Length says nothing about the PDF
+            size = int(head.headers.get("Content-Length", -1)) if head.is_success else -1
+        except Exception:
+            size = -1
+        if size == cached.stat().st_size:
+            log.info(f"  → PDF cache hit: {url}")
+            return cached
+
+    if await _stream_pdf(http, url, cached):
+        return cached
+    return None
+
+
+# url → download task; promos sharing a flyer await the same one this run
+_pdf_downloads: dict = {}
+
+
+async def download_pdf(http: httpx.AsyncClient, url: str, dest: Path) -> bool:
+    task = _pdf_downloads.get(url)
+    if task is None:
+        task = _pdf_downloads[url] = asyncio.ensure_future(_cached_pdf(http, url))
+
+    cached = await asyncio.shield(task)
+    if cached is None:
+        # Forget the failure → a later promo with the same flyer tries again
+        if _pdf_downloads.get(url) is task:
+            del _pdf_downloads[url]
+        return False
 
-def convert_pdf_to_images(pdf_file: Path, out_dir: Path) -> int:
+    # Hardlink the cached file into the promo folder; copy across filesystems
+    dest.unlink(missing_ok=True)
     try:
-        import fitz
-    except:
-        print(" PyMuPDF not installed → skipping conversion.")
-        return 0
+        os.link(cached, dest)
+    except OSError:
+        shutil.copyfile(cached, dest)
+
+    log.info(f"   Saved PDF: {dest}")
+    return True
+
+
+def clear_pages(out_dir: Path) -> None:
+    # Drop pages from earlier runs (older runs wrote .png) → no duplicates for Gemini/Excel
+    for old in [*out_dir.glob("page_*.png"), *out_dir.glob("page_*.jpg")]:
+        old.unlink(missing_ok=True)
+
+
+def _render_page(pdf_path: str, index: int, out_path: str) -> None:
+    # Runs in a worker process → each worker opens its own document (MuPDF docs aren't shareable)
+    doc = fitz.open(pdf_path)
+    pix = doc.load_page(index).get_pixmap(matrix=_ZOOM_MAT, colorspace=fitz.csRGB, alpha=False)
+    pix.save(out_path, jpg_quality=JPEG_QUALITY)
+    doc.close()
 
+
+def _prepare_pages(pdf_file: Path, out_dir: Path) -> int:
     doc = fitz.open(pdf_file)
     count = doc.page_count
-    out_dir.mkdir(parents=True, exist_ok=True)
+    doc.close()
+    if count:
+        out_dir.mkdir(parents=True, exist_ok=True)
+        clear_pages(out_dir)
+    return count
 
-    for i in range(count):
-        page = doc.load_page(i)
-        pix = page.get_pixmap(matrix=fitz.Matrix(2, 2))
-        outfile = out_dir / f"page_{i+1:03d}.png"
-        pix.save(outfile)
-        print(f" Converted page {i+1}/{count}")
 
-    doc.close()
+async def convert_pdf_to_images(pdf_file: Path, out_dir: Path, pool: ProcessPoolExecutor) -> int:
+    if fitz is None:
+        log.warning(" PyMuPDF not installed → skipping conversion.")
+        return 0
+
+    count = await asyncio.to_thread(_prepare_pages, pdf_file, out_dir)
+    if count == 0:
+        return 0
+
+    # Rasterizing is pure CPU → pages go to the shared process pool
+    loop = asyncio.get_running_loop()
+    renders = [
+        loop.run_in_executor(pool, _render_page, str(pdf_file), i, str(out_dir / f"page_{i+1:03d}.jpg"))
+        for i in range(count)
+    ]
+    try:
+        for done, next_done in enumerate(asyncio.as_completed(renders), 1):
+            await next_done
+            log.info(f" Converted page {done}/{count}")
+    finally:
+        # On failure, don't leave the remaining pages queued in the pool
+        for render in renders:
+            render.cancel()
+        await asyncio.gather(*renders, return_exceptions=True)
+
     return count
 
 
 # ============================================================
 # FLIPBOOK (index.html) SCREENSHOTTER
 # ============================================================
+# Known "next page" controls, in priority order
+_NEXT_BUTTONS = [".pageClickAreaRight", ".flipbook-right-arrow", ".swiper-button-next"]
+# One query per page picks the first control present, keeping that priority
+# (a CSS selector list would pick whichever comes first in the DOM instead)
+_FIRST_PRESENT_JS = "(sels) => sels.find(s => document.querySelector(s)) || null"
+# Page element is laid out and no longer the one we just captured → new page rendered
+_PAGE_TURNED_JS = """([sel, prev]) => {
+    const el = document.querySelector(sel);
+    return el && el.getBoundingClientRect().width > 0 && el.outerHTML !== prev;
+}"""
+
+
 async def screenshot_flipbook_index(page: Page, url: str, out_dir: Path) -> int:
-    await page.goto(url, timeout=NAV_TIMEOUT)
-    await page.wait_for_load_state("load")
+    await page.goto(url, wait_until="load", timeout=NAV_TIMEOUT)
 
     selectors = [
         ".flipbook-page-html",
@@ -163,48 +412,76 @@ async def screenshot_flipbook_index(page: Page, url: str, out_dir: Path) -> int:
                 break
 
     if not found:
-        print(" No flipbook selector found")
+        log.warning(" No flipbook selector found")
         return 0
 
-    print(f"  → Using flipbook selector: {found}")
+    log.info(f"  → Using flipbook selector: {found}")
     out_dir.mkdir(parents=True, exist_ok=True)
+    clear_pages(out_dir)
+
+    try:
+        await ctx.locator(found).first.wait_for(state="visible", timeout=PAGE_TURN_TIMEOUT_MS)
+    except:
+        pass
 
     page_num = 1
+    prev_hash = None
+    watch_turns = True
     while page_num <= 500:
         locator = ctx.locator(found).first
-        await ctx.wait_for_timeout(200)
 
-        outfile = out_dir / f"page_{page_num:03d}.png"
+        outfile = out_dir / f"page_{page_num:03d}.jpg"
 
         try:
-            await locator.screenshot(path=str(outfile))
-            print(f" Saved page {page_num}")
+            shot = await locator.screenshot(type="jpeg", quality=JPEG_QUALITY)
         except:
             break
 
-        # Next page
-        next_buttons = [
-            ".pageClickAreaRight",
-            ".flipbook-right-arrow",
-            ".swiper-button-next"
-        ]
-
-        clicked = False
-        for btn in next_buttons:
-            el = ctx.locator(btn).first
-            if await el.count() > 0:
-                try:
-                    await el.click()
-                except:
-                    await ctx.evaluate(
-                        "(sel)=>{let e=document.querySelector(sel);e&&e.click();}",
-                        btn
-                    )
-                clicked = True
-                break
+        # Same pixels as the previous page → "next" no longer advances, catalog ended
+        digest = blake2b(shot, digest_size=16).digest()
+        if digest == prev_hash:
+            break
+        prev_hash = digest
 
-        if not clicked:
+        outfile.write_bytes(shot)
+        log.info(f" Saved page {page_num}")
+
+        # Next page
+        btn = await ctx.evaluate(_FIRST_PRESENT_JS, _NEXT_BUTTONS)
+        if not btn:
             break
+        el = ctx.locator(btn).first
+
+        prev_html = None
+        if watch_turns:
+            try:
+                prev_html = await locator.evaluate("el => el.outerHTML")
+            except:
+                watch_turns = False
+
+        try:
+            await el.click()
+        except:
+            await ctx.evaluate(
+                "(sel)=>{let e=document.querySelector(sel);e&&e.click();}",
+                btn
+            )
+
+        # Wait for the page to actually change instead of a fixed sleep.
+        # Flipbooks whose element never changes (page kept in place) time out
+        # once, then fall back to the short fixed delay; the hash check above
+        # still stops on a repeated page either way.
+        if watch_turns:
+            try:
+                await ctx.wait_for_function(
+                    _PAGE_TURNED_JS,
+                    arg=[found, prev_html],
+                    timeout=PAGE_TURN_TIMEOUT_MS
+                )
+            except:
+                watch_turns = False
+        else:
+            await ctx.wait_for_timeout(200)
 
         page_num += 1
 
@@ -214,38 +491,52 @@ async def screenshot_flipbook_index(page: Page, url: str, out_dir: Path) -> int:
 # ============================================================
 # CAPTURE SINGLE PROMO (FINAL LOGIC)
 # ============================================================
-async def capture_single(promo: dict, browser):
+async def capture_single(
+    promo: dict,
+    context: BrowserContext,
+    http: httpx.AsyncClient,
+    render_pool: ProcessPoolExecutor
+):
     folder = Path("output") / promo["folder"]
     folder.mkdir(parents=True, exist_ok=True)
 
-    print(f"\n Capturing: {promo['title']}")
-    print(f"    URL: {promo['link']}")
+    log.info(f"\n Capturing: {promo['title']}")
+    log.info(f"    URL: {promo['link']}")
 
-    page = await browser.new_page()
-    await block_nonflip_images(page)
+    page = await context.new_page()
+    inflight = track_inflight_requests(page)
+    pdf_seen = watch_pdf_requests(page)
 
     try:
-        await page.goto(promo["link"], timeout=NAV_TIMEOUT)
-        await page.wait_for_load_state("load")
-
-        # CRITICAL: wait for dynamic JS/Real3D scripts
-        await page.wait_for_timeout(3500)
-
-        # Try to wait for Real3D <script> tag
-        try:
-            await page.wait_for_selector('script[id^="real3d-flipbook-options"]', timeout=5000)
-        except:
-            pass
+        # Race the full load against the first .pdf the page itself requests
+        loading = asyncio.create_task(load_promo_page(page, promo["link"], inflight))
+        await asyncio.wait({loading, pdf_seen}, return_when=asyncio.FIRST_COMPLETED)
+
+        idx = None
+        if pdf_seen.done():
+            # ---- 0) PDF already requested → rest of the load is wasted time ----
+            loading.cancel()
+            await asyncio.gather(loading, return_exceptions=True)
+            pdf = pdf_seen.result()
+        else:
+            await loading  # re-raises navigation errors
 
-        # Reload fully updated HTML
-        html = await page.content()
+            # ---- 1) Real3D / direct PDF detection (inline scripts + embed srcs only) ----
+            snippet = await page.evaluate(_SCRIPTS_AND_EMBEDS_JS)
+            pdf = await extract_pdf_url_from_html(snippet)
+            if not pdf:
+                idx = await extract_flipbook_index_html(snippet)
 
-        # ---- 1) Real3D / direct PDF detection ----
-        pdf = await extract_pdf_url_from_html(html)
+            # Neither in scripts/embeds → fall back to the fully updated HTML
+            if not pdf and not idx:
+                html = await page.content()
+                pdf = await extract_pdf_url_from_html(html)
+                if not pdf:
+                    idx = await extract_flipbook_index_html(html)
 
-        # ---- 2) Deep iframe scan ----
-        if not pdf:
-            pdf = await extract_pdf_from_iframes(page)
+            # ---- 2) Deep iframe scan ----
+            if not pdf:
+                pdf = await extract_pdf_from_iframes(page)
 
         if pdf:
             pdf_dir = folder / "PDF"
@@ -254,23 +545,23 @@ async def capture_single(promo: dict, browser):
             pdf_name = pdf.split("/")[-1].split("?")[0]
             pdf_path = pdf_dir / pdf_name
 
-            if await download_pdf(page, pdf, pdf_path):
+            if await download_pdf(http, pdf, pdf_path):
                 if CONVERT_PDF_TO_PNG:
-                    count = convert_pdf_to_images(pdf_path, folder / "pages")
-                    print(f"  Converted PDF → {count} pages")
+                    # Rendered in the shared pool → other captures keep running meanwhile
+                    count = await convert_pdf_to_images(pdf_path, folder / "pages", render_pool)
+                    log.info(f"  Converted PDF → {count} pages")
             return
 
         # ---- 3) index.html flipbooks ----
-        idx = await extract_flipbook_index_html(html)
         if idx:
             pages = await screenshot_flipbook_index(page, idx, folder / "pages")
-            print(f"  Captured {pages} flipbook pages")
+            log.info(f"  Captured {pages} flipbook pages")
             return
 
-        print("  No PDF or Flipbook found.")
+        log.warning("  No PDF or Flipbook found.")
 
     except Exception as e:
-        print(f"  Error: {e}")
+        log.warning(f"  Error: {e}")
 
     finally:
         await page.close()
@@ -279,72 +570,73 @@ async def capture_single(promo: dict, browser):
 # ============================================================
 # PROMO LIST SCRAPER
 # ============================================================
-async def get_promos(page: Page):
-    print("Loading promo list...\n")
-    await page.goto(PROMO_LIST_URL, timeout=NAV_TIMEOUT)
-    await page.wait_for_load_state("load")
-
-    await page.wait_for_selector("div.promotion-page")
-
-    cards = page.locator("div.promotion-page")
-    count = await cards.count()
-    print(f"Found {count} promo cards\n")
-
-    promos = []
-
-    for i in range(count):
-        card = cards.nth(i)
-
-        # ----- title -----
-        try:
-            title = (await card.locator("h2").inner_text()).strip()
-        except:
-            title = ""
-
-        promo_id = await card.get_attribute("id")
-        if not title and promo_id:
-            title = promo_id.replace("-", " ").title()
-
-        # ----- link extraction -----
-        link = None
+# First anchor that isn't an image thumbnail → the real promo link in one query
+_PROMO_LINK_SEL = (
+    "a[href]:not([href$='.png' i]):not([href$='.jpg' i])"
+    ":not([href$='.jpeg' i]):not([href$='.webp' i])"
+)
+
+# One evaluate reads every card's title/id/href/onclick → no per-card round-trips
+_CARDS_JS = """(sel) => Array.from(document.querySelectorAll('div.promotion-page')).map(card => {
+    const h2 = card.querySelector('h2');
+    const a = card.querySelector(sel);
+    return {
+        title: h2 ? h2.innerText.trim() : '',
+        id: card.getAttribute('id'),
+        href: a ? a.getAttribute('href') : null,
+        onclick: card.getAttribute('onclick')
+    };
+})"""
+
+
+def _promo_from_card(card: dict) -> Optional[dict]:
+    # ----- title -----
+    title = card.get("title") or ""
+
+    promo_id = card.get("id")
+    if not title and promo_id:
+        title = promo_id.replace("-", " ").title()
+
+    # ----- link extraction -----
+    # 1. <a href="">
+    link = card.get("href") or None
+
+    # 2. onclick="window.location='...'"
+    if not link:
+        onclick = card.get("onclick")
+        if onclick:
+            m = _ONCLICK_RE.search(onclick)
+            if m:
+                link = m.group(1)
+
+    # 3. fallback via id
+    if not link and promo_id:
+        link = f"/{promo_id}/"
+
+    # normalize
+    if link and not link.startswith("http"):
+        link = "https://www.indomaret.co.id" + link
+
+    if not link:
+        return None
+
+    return {
+        "title": title or safe(link.split('/')[-2]),
+        "link": link,
+        "folder": safe(title or link.split('/')[-2])
+    }
 
-        # 1. <a href="">
-        try:
-            a = card.locator("a").first
-            if await a.count() > 0:
-                href = await a.get_attribute("href")
-                if href:
-                    link = href
-        except:
-            pass
 
-        # 2. onclick="window.location='...'"
-        if not link:
-            try:
-                onclick = await card.get_attribute("onclick")
-                if onclick:
-                    m = re.search(r"['\"](/[^'\"]+)['\"]", onclick)
-                    if m:
-                        link = m.group(1)
-            except:
-                pass
-
-        # 3. fallback via id
-        if not link and promo_id:
-            link = f"/{promo_id}/"
+async def get_promos(page: Page):
+    log.info("Loading promo list...\n")
+    await page.goto(PROMO_LIST_URL, wait_until="load", timeout=NAV_TIMEOUT)
 
-        # normalize
-        if link and not link.startswith("http"):
-            link = "https://www.indomaret.co.id" + link
+    await page.wait_for_selector("div.promotion-page")
 
-        if not link:
-            continue
+    cards = await page.evaluate(_CARDS_JS, _PROMO_LINK_SEL)
+    log.info(f"Found {len(cards)} promo cards\n")
 
-        promos.append({
-            "title": title or safe(link.split('/')[-2]),
-            "link": link,
-            "folder": safe(title or link.split('/')[-2])
-        })
+    promos = [p for p in map(_promo_from_card, cards) if p]
 
     # dedupe
     seen = set()
@@ -371,29 +663,67 @@ async def main():
             ]
         )
 
-        page = await browser.new_page()
-        await block_nonflip_images(page)
+        # Small pool of long-lived contexts (one per worker) → HTTP cache and
+        # compiled JS stay warm across promos instead of a fresh context each time
+        contexts = [await browser.new_context() for _ in range(CAPTURE_CONCURRENCY)]
+        for context in contexts:
+            await block_nonflip_images(context)
+
+        page = await contexts[0].new_page()
 
         promos = await get_promos(page)
+        # PDF downloads go through httpx → present them as this browser, not python-httpx
+        user_agent = await page.evaluate("navigator.userAgent")
         await page.close()
 
-        print(" STARTING CAPTURE")
+        log.info(" STARTING CAPTURE")
 
-        for promo in promos:
-            await capture_single(promo, browser)
+        pool = asyncio.Queue()
+        for context in contexts:
+            pool.put_nowait(context)
+
+        # One render pool for the whole run → at most one process per core however
+        # many flyers convert at once; "spawn" so workers aren't forked from this
+        # multi-threaded process (log listener, to_thread workers)
+        render_pool = ProcessPoolExecutor(
+            max_workers=os.cpu_count() or 1,
+            mp_context=multiprocessing.get_context("spawn")
+        )
+
+        # One HTTP client for all PDF downloads → keep-alive/DNS shared across flyers
+        async with httpx.AsyncClient(
+            headers={"User-Agent": user_agent, "Referer": "https://www.indomaret.co.id/"},
+            timeout=DOWNLOAD_TIMEOUT / 1000,
+            follow_redirects=True
+        ) as http:
+
+            async def bounded(promo):
+                # Taking a context from the pool also caps concurrency
+                context = await pool.get()
+                try:
+                    await capture_single(promo, context, http, render_pool)
+                finally:
+                    pool.put_nowait(context)
+
+            try:
+                await asyncio.gather(*(bounded(promo) for promo in promos))
+            finally:
+                render_pool.shutdown(cancel_futures=True)
 
         await browser.close()
-        print("\n ALL PROMOS DONE!")
+        log.info("\n ALL PROMOS DONE!")
 
 
 if __name__ == "__main__":
-    Path("output").mkdir(exist_ok=True)
-    print("Welcome to Indomaret Scraper!")
-    print(f"Output will be saved in: {os.path.abspath('output')}\n")
+    listener = setup_logging()
+    PDF_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    log.info("Welcome to Indomaret Scraper!")
+    log.info(f"Output will be saved in: {os.path.abspath('output')}\n")
 
-    try:
-        import fitz
-    except:
-        print("PyMuPDF not installed — PDF → PNG disabled.")
+    if fitz is None:
+        log.warning("PyMuPDF not installed — PDF → PNG disabled.")
 
-    asyncio.run(main())
+    try:
+        asyncio.run(main())
+    finally:
+        listener.stop()